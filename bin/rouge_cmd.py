@@ -17,6 +17,12 @@ def main():
                         action='store_true')
     parser.add_argument('--ignore_empty', action='store_true',
                         help="Ignore empty hypothesis")
+    parser.add_argument('--state', type=str, default=None,
+                        help="File mode checkpoint file, resume from it "
+                             "if it exists")
+    parser.add_argument('--checkpoint_every', type=int, default=None,
+                        help="Lines between two checkpoints (with --state, "
+                             "default=10000)")
     parser.add_argument('hypothesis', type=str, help='Text of file path')
     parser.add_argument('reference', type=str, help='Text or file path')
     parser.add_argument("--metrics", nargs="+", type=str.upper,
@@ -28,6 +34,15 @@ def main():
 
     args = parser.parse_args()
 
+    if not args.file:
+        if args.state is not None:
+            parser.error("--state requires -f/--file")
+        if args.checkpoint_every is not None:
+            parser.error("--checkpoint_every requires -f/--file")
+    checkpoint_every = args.checkpoint_every
+    if checkpoint_every is None:
+        checkpoint_every = 10000
+
     metrics = args.metrics
     stats = args.stats
 
@@ -41,7 +56,8 @@ def main():
 
         files_rouge = FilesRouge(metrics, stats)
         scores = files_rouge.get_scores(
-            hyp, ref, avg=args.avg, ignore_empty=args.ignore_empty)
+            hyp, ref, avg=args.avg, ignore_empty=args.ignore_empty,
+            state_path=args.state, checkpoint_every=checkpoint_every)
 
         print(json.dumps(scores, indent=2))
     else:
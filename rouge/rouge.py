@@ -3,6 +3,8 @@ from __future__ import absolute_import
 import six
 import rouge.rouge_score as rouge_score
 import io
+import itertools
+import json
 import os
 
 
@@ -26,16 +28,26 @@ class FilesRouge:
         hyp_lc = line_count(hyp_path)
         ref_lc = line_count(ref_path)
         assert(hyp_lc == ref_lc)
+        return hyp_lc
 
-    def get_scores(self, hyp_path, ref_path, avg=False, ignore_empty=False):
+    def get_scores(self, hyp_path, ref_path, avg=False, ignore_empty=False,
+                   state_path=None, checkpoint_every=10000):
         """Calculate ROUGE scores between each pair of
         lines (hyp_file[i], ref_file[i]).
         Args:
           * hyp_path: hypothesis file path
           * ref_path: references file path
           * avg (False): whether to get an average scores or a list
+          * state_path (None): checkpoint file, running again with the same
+                               file resumes an interrupted job
+          * checkpoint_every (10000): number of lines between checkpoints
         """
-        self._check_files(hyp_path, ref_path)
+        line_count = self._check_files(hyp_path, ref_path)
+
+        if state_path is not None:
+            return self._get_checkpointed_scores(
+                hyp_path, ref_path, line_count, state_path, checkpoint_every,
+                avg=avg, ignore_empty=ignore_empty)
 
         with io.open(hyp_path, encoding="utf-8", mode="r") as hyp_file:
             hyps = [line[:-1] for line in hyp_file]
@@ -46,6 +58,120 @@ class FilesRouge:
         return self.rouge.get_scores(hyps, refs, avg=avg,
                                      ignore_empty=ignore_empty)
 
+    def _get_config(self, avg, ignore_empty):
+        return {
+            "metrics": self.rouge.metrics,
+            "stats": self.rouge.stats,
+            "exclusive": self.rouge.exclusive,
+            "raw_results": self.rouge.raw_results,
+            "return_lengths": self.rouge.return_lengths,
+            "avg": avg,
+            "ignore_empty": ignore_empty,
+        }
+
+    def _get_inputs(self, hyp_path, ref_path, line_count):
+        """Identifies the input files, so that a state file is only resumed
+        on the files it was created with
+        """
+        inputs = {"line_count": line_count}
+        for name, path in [("hyp", hyp_path), ("ref", ref_path)]:
+            stat = os.stat(path)
+            inputs[name] = {
+                "path": os.path.abspath(path),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+        return inputs
+
+    def _load_state(self, state_path, config, inputs):
+        if not os.path.isfile(state_path):
+            return {
+                "config": config,
+                "inputs": inputs,
+                "offset": 0,
+                "scores": self.rouge._empty_sums(),
+                "count": 0,
+                "scores_size": 0,
+            }
+
+        with io.open(state_path, encoding="utf-8", mode="r") as f:
+            state = json.load(f)
+        if state["config"] != config:
+            raise ValueError("State file '%s' was created with a different "
+                             "configuration: %s" % (state_path,
+                                                    state["config"]))
+        if state["inputs"] != inputs:
+            raise ValueError("State file '%s' was created with different "
+                             "input files: %s" % (state_path,
+                                                  state["inputs"]))
+        return state
+
+    def _save_state(self, state_path, state):
+        # write then rename, so that the state file is never partial
+        tmp_path = state_path + ".tmp"
+        with io.open(tmp_path, encoding="utf-8", mode="w") as f:
+            f.write(six.text_type(json.dumps(state)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_path)
+
+    def _get_checkpointed_scores(self, hyp_path, ref_path, line_count,
+                                 state_path, checkpoint_every, avg=False,
+                                 ignore_empty=False):
+        """Same as `get_scores`, processing files `checkpoint_every` lines
+        at a time. After each chunk, the line offset and either the running
+        sums (`avg`) or the size of the per-line scores file
+        (`state_path + '.scores'`, one JSON per line) are saved to
+        `state_path`, so that an interrupted job resumes where it stopped
+        and gives the same results.
+        """
+        assert(checkpoint_every > 0)
+        state = self._load_state(
+            state_path, self._get_config(avg, ignore_empty),
+            self._get_inputs(hyp_path, ref_path, line_count))
+        scores_path = state_path + ".scores"
+
+        if not avg:
+            # drop scores written after the last checkpoint
+            with open(scores_path, "ab") as scores_file:
+                scores_file.truncate(state["scores_size"])
+
+        with io.open(hyp_path, encoding="utf-8", mode="r") as hyp_file, \
+                io.open(ref_path, encoding="utf-8", mode="r") as ref_file:
+            lines = itertools.islice(zip(hyp_file, ref_file),
+                                     state["offset"], None)
+            while True:
+                chunk = list(itertools.islice(lines, checkpoint_every))
+                if len(chunk) == 0:
+                    break
+
+                hyps = [hyp[:-1] for hyp, _ in chunk]
+                refs = [ref[:-1] for _, ref in chunk]
+                if ignore_empty:
+                    hyps, refs = Rouge._filter_empty(hyps, refs)
+
+                if avg:
+                    state["scores"], state["count"] = self.rouge._sum_scores(
+                        hyps, refs, scores=state["scores"],
+                        count=state["count"])
+                else:
+                    with open(scores_path, "ab") as scores_file:
+                        for score in self.rouge._get_scores(hyps, refs):
+                            line = json.dumps(score) + "\n"
+                            scores_file.write(line.encode("utf-8"))
+                        scores_file.flush()
+                        os.fsync(scores_file.fileno())
+                        state["scores_size"] = scores_file.tell()
+
+                state["offset"] += len(chunk)
+                self._save_state(state_path, state)
+
+        if avg:
+            return self.rouge._avg_scores(state["scores"], state["count"])
+
+        with io.open(scores_path, encoding="utf-8", mode="r") as scores_file:
+            return [json.loads(line) for line in scores_file]
+
 
 class Rouge:
     DEFAULT_METRICS = ["rouge-1", "rouge-2", "rouge-l"]
@@ -60,13 +186,21 @@ class Rouge:
     }
     DEFAULT_STATS = ["r", "p", "f"]
     AVAILABLE_STATS = ["r", "p", "f"]
+    # number of lines whose LCS are computed at once by the 'numpy' backend
+    LCS_CHUNK_SIZE = 1024
 
     def __init__(self, metrics=None, stats=None, return_lengths=False,
-                 raw_results=False, exclusive=True):
+                 raw_results=False, exclusive=True, lcs_backend="python"):
         self.return_lengths = return_lengths
         self.raw_results = raw_results
         self.exclusive = exclusive
 
+        if lcs_backend not in rouge_score.LCS_BACKENDS:
+            raise ValueError("Unknown LCS backend '%s'" % lcs_backend)
+        if lcs_backend == "numpy" and rouge_score.np is None:
+            raise ImportError("The 'numpy' LCS backend requires numpy")
+        self.lcs_backend = lcs_backend
+
         if metrics is not None:
             self.metrics = [m.lower() for m in metrics]
 
@@ -93,12 +227,7 @@ class Rouge:
             hyps, refs = [hyps], [refs]
 
         if ignore_empty:
-            # Filter out hyps of 0 length
-            hyps_and_refs = zip(hyps, refs)
-            hyps_and_refs = [_ for _ in hyps_and_refs
-                             if len(_[0]) > 0
-                             and len(_[1]) > 0]
-            hyps, refs = zip(*hyps_and_refs)
+            hyps, refs = Rouge._filter_empty(hyps, refs)
 
         assert(isinstance(hyps, type(refs)))
         assert(len(hyps) == len(refs))
@@ -107,21 +236,63 @@ class Rouge:
             return self._get_scores(hyps, refs)
         return self._get_avg_scores(hyps, refs)
 
+    @staticmethod
+    def _filter_empty(hyps, refs):
+        """Filter out pairs where the hyp or the ref is of 0 length"""
+        hyps_and_refs = [_ for _ in zip(hyps, refs)
+                         if len(_[0]) > 0
+                         and len(_[1]) > 0]
+        return ([hyp for hyp, _ in hyps_and_refs],
+                [ref for _, ref in hyps_and_refs])
+
+    @staticmethod
+    def _split_sentences(text):
+        return [" ".join(_.split()) for _ in text.split(".") if len(_) > 0]
+
+    def _get_lcs_cache(self, hyps, refs):
+        """Computes the LCS of every sentence pair of every (hyp, ref) at
+        once when using the 'numpy' backend, otherwise returns None
+        """
+        if self.lcs_backend != "numpy" or "rouge-l" not in self.metrics:
+            return None
+
+        pairs = []
+        for hyp, ref in zip(hyps, refs):
+            hyp = Rouge._split_sentences(hyp)
+            ref = Rouge._split_sentences(ref)
+            pairs.extend(rouge_score._lcs_sentence_pairs(hyp, ref))
+        return rouge_score._batch_recon_lcs(pairs)
+
+    def _iter_with_lcs_cache(self, hyps, refs):
+        """Yields (hyp, ref, lcs_cache) for each pair, the LCS cache being
+        computed `LCS_CHUNK_SIZE` lines at a time to bound memory usage
+        """
+        for start in range(0, len(hyps), Rouge.LCS_CHUNK_SIZE):
+            chunk_hyps = hyps[start:start + Rouge.LCS_CHUNK_SIZE]
+            chunk_refs = refs[start:start + Rouge.LCS_CHUNK_SIZE]
+            lcs_cache = self._get_lcs_cache(chunk_hyps, chunk_refs)
+            for hyp, ref in zip(chunk_hyps, chunk_refs):
+                yield hyp, ref, lcs_cache
+
     def _get_scores(self, hyps, refs):
         scores = []
-        for hyp, ref in zip(hyps, refs):
+        for hyp, ref, lcs_cache in self._iter_with_lcs_cache(hyps, refs):
             sen_score = {}
 
-            hyp = [" ".join(_.split()) for _ in hyp.split(".") if len(_) > 0]
-            ref = [" ".join(_.split()) for _ in ref.split(".") if len(_) > 0]
+            hyp = Rouge._split_sentences(hyp)
+            ref = Rouge._split_sentences(ref)
 
             for m in self.metrics:
                 fn = Rouge.AVAILABLE_METRICS[m]
+                kwargs = {}
+                if m == "rouge-l":
+                    kwargs["lcs_cache"] = lcs_cache
                 sc = fn(
                     hyp,
                     ref,
                     raw_results=self.raw_results,
-                    exclusive=self.exclusive)
+                    exclusive=self.exclusive,
+                    **kwargs)
                 sen_score[m] = {s: sc[s] for s in self.stats}
 
             if self.return_lengths:
@@ -134,18 +305,33 @@ class Rouge:
         return scores
 
     def _get_avg_scores(self, hyps, refs):
+        scores, count = self._sum_scores(hyps, refs)
+        return self._avg_scores(scores, count)
+
+    def _empty_sums(self):
         scores = {m: {s: 0 for s in self.stats} for m in self.metrics}
         if self.return_lengths:
             scores["lengths"] = {"hyp": 0, "ref": 0}
+        return scores
+
+    def _sum_scores(self, hyps, refs, scores=None, count=0):
+        """Adds the scores of each (hyp, ref) to the running sums `scores`
+        Returns:
+          the updated sums and number of pairs
+        """
+        if scores is None:
+            scores = self._empty_sums()
 
-        count = 0
-        for (hyp, ref) in zip(hyps, refs):
-            hyp = [" ".join(_.split()) for _ in hyp.split(".") if len(_) > 0]
-            ref = [" ".join(_.split()) for _ in ref.split(".") if len(_) > 0]
+        for hyp, ref, lcs_cache in self._iter_with_lcs_cache(hyps, refs):
+            hyp = Rouge._split_sentences(hyp)
+            ref = Rouge._split_sentences(ref)
 
             for m in self.metrics:
                 fn = Rouge.AVAILABLE_METRICS[m]
-                sc = fn(hyp, ref, exclusive=self.exclusive)
+                kwargs = {}
+                if m == "rouge-l":
+                    kwargs["lcs_cache"] = lcs_cache
+                sc = fn(hyp, ref, exclusive=self.exclusive, **kwargs)
                 scores[m] = {s: scores[m][s] + sc[s] for s in self.stats}
 
             if self.return_lengths:
@@ -153,6 +339,9 @@ class Rouge:
                 scores["lengths"]["ref"] += len(" ".join(ref).split())
 
             count += 1
+        return scores, count
+
+    def _avg_scores(self, scores, count):
         avg_scores = {
             m: {s: scores[m][s] / count for s in self.stats}
             for m in self.metrics
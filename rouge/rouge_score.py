@@ -26,10 +26,20 @@ https://github.com/miso-belica/sumy/blob/dev/sumy/evaluation/rouge.py.
 """
 from __future__ import absolute_import
 from __future__ import division, print_function, unicode_literals
+import heapq
 import itertools
+import random
+import zlib
 
 from copy import deepcopy
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LCS_BACKENDS = ["python", "numpy"]
+
 
 class Ngrams(object):
     """
@@ -83,6 +93,125 @@ class Ngrams(object):
             return Ngrams(union_list, exclusive=False)
 
 
+class NgramsSketch(object):
+    """
+        Fixed-size MinHash signature of an `Ngrams` collection.
+
+        Stores `num_perm` 32-bit min-hashes as a numpy `uint32` array
+        (`4 * num_perm` bytes) and the exact n-gram count, so that the
+        overlap between two collections can be estimated without keeping
+        the n-grams around. The standard error of the Jaccard estimate is
+        about `1 / sqrt(num_perm)`. With `exclusive=False` each repeated
+        n-gram is hashed together with its occurrence index, which turns the
+        multiset intersection into a set intersection.
+
+        Only sketches sharing `n`, `exclusive`, `num_perm` and `seed` can be
+        compared. Requires numpy.
+    """
+
+    def __init__(self, ngrams, n, num_perm=128, seed=1):
+        if np is None:
+            raise ImportError("NgramsSketch requires numpy")
+        if num_perm <= 0:
+            raise ValueError("num_perm must be > 0")
+        self.n = n
+        self.exclusive = ngrams.exclusive
+        self.num_perm = num_perm
+        self.seed = seed
+        self.count = len(ngrams)
+
+        occurrences = {}
+        hashes = []
+        for ngram in ngrams._ngrams:
+            key = " ".join(ngram)
+            k = occurrences.get(key, 0)
+            occurrences[key] = k + 1
+            if k > 0:
+                key = "%s\x00%d" % (key, k)
+            hashes.append(zlib.crc32(key.encode("utf-8")) & 0xffffffff)
+
+        if len(hashes) == 0:
+            self.signature = np.full(num_perm, 0xffffffff, dtype=np.uint32)
+        else:
+            # multiply-shift hashing, uint64 arithmetic wraps modulo 2**64
+            a, b = _sketch_permutations(num_perm, seed)
+            hashes = np.array(hashes, dtype=np.uint64)
+            permuted = (a[:, None] * hashes[None, :] + b[:, None]) >> 32
+            self.signature = permuted.min(axis=1).astype(np.uint32)
+
+    def __len__(self):
+        return self.count
+
+    def params(self):
+        return (self.n, self.exclusive, self.num_perm, self.seed)
+
+    def jaccard(self, o):
+        _check_sketch_params(self, o)
+        if self.count == 0 or o.count == 0:
+            return 0.0
+        matches = np.count_nonzero(self.signature == o.signature)
+        return float(matches / self.num_perm)
+
+    def intersection_count(self, o):
+        """Estimated size of the intersection, as a float"""
+        jaccard = self.jaccard(o)
+        estimate = jaccard * (self.count + o.count) / (1.0 + jaccard)
+        return min(estimate, float(min(self.count, o.count)))
+
+
+class NgramsSketchIndex(object):
+    """
+        Many `NgramsSketch` stacked into a single (len, num_perm) `uint32`
+        matrix, so that a hypothesis is compared with every stored
+        reference in a few vectorized operations.
+    """
+
+    def __init__(self, sketches):
+        if len(sketches) <= 0:
+            raise ValueError("Index must contain at least 1 sketch.")
+        self.n = sketches[0].n
+        self.exclusive = sketches[0].exclusive
+        self.num_perm = sketches[0].num_perm
+        self.seed = sketches[0].seed
+        for sketch in sketches:
+            _check_sketch_params(self, sketch)
+        self.signatures = np.vstack([sketch.signature for sketch in sketches])
+        self.counts = np.array([len(sketch) for sketch in sketches],
+                               dtype=np.float64)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def params(self):
+        return (self.n, self.exclusive, self.num_perm, self.seed)
+
+    def intersection_counts(self, sketch):
+        """Estimated intersection size with each sketch of the index"""
+        _check_sketch_params(self, sketch)
+        jaccard = np.count_nonzero(
+            self.signatures == sketch.signature, axis=1) / self.num_perm
+        if len(sketch) == 0:
+            jaccard[:] = 0.0
+        jaccard[self.counts == 0] = 0.0
+        estimate = jaccard * (self.counts + len(sketch)) / (1.0 + jaccard)
+        return np.minimum(estimate, np.minimum(self.counts, len(sketch)))
+
+
+def _check_sketch_params(a, b):
+    if a.params() != b.params():
+        raise ValueError("Sketches must share `n`, `exclusive`, `num_perm` "
+                         "and `seed`, got %s and %s" % (a.params(),
+                                                        b.params()))
+
+
+def _sketch_permutations(num_perm, seed):
+    """Returns the `num_perm` (a, b) parameters of the hash functions"""
+    rng = random.Random(seed)
+    a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+    b = [rng.getrandbits(64) for _ in range(num_perm)]
+    return np.array(a, dtype=np.uint64), np.array(b, dtype=np.uint64)
+
+
 def _get_ngrams(n, text, exclusive=True):
     """Calcualtes n-grams.
 
@@ -129,9 +258,52 @@ def _len_lcs(x, y):
     Returns
       integer: Length of LCS between x and y
     """
+    prefix, x, y, suffix = _trim_lcs_inputs(x, y)
+    if len(x) == 0 or len(y) == 0:
+        return len(prefix) + len(suffix)
     table = _lcs(x, y)
     n, m = len(x), len(y)
-    return table[n, m]
+    return len(prefix) + table[n, m] + len(suffix)
+
+
+def _trim_lcs_inputs(x, y):
+    """
+    Reduces x and y to the part that actually needs the LCS DP table.
+
+    The common prefix and suffix of x and y always belong to the LCS, and
+    tokens that do not occur in the other sequence can never be matched, so
+    both are removed before filling the table. The LCS of the original
+    sequences is `prefix + LCS(x', y') + suffix`.
+
+    Args:
+      x: sequence of words
+      y: sequence of words
+
+    Returns:
+      tuple (prefix, x', y', suffix): common prefix, reduced x, reduced y
+      and common suffix
+    """
+    n, m = len(x), len(y)
+    start = 0
+    while start < n and start < m and x[start] == y[start]:
+        start += 1
+
+    end = 0
+    while (end < n - start and end < m - start
+           and x[n - 1 - end] == y[m - 1 - end]):
+        end += 1
+
+    prefix = list(x[:start])
+    suffix = list(x[n - end:n])
+    x, y = x[start:n - end], y[start:m - end]
+
+    shared = set(x).intersection(y)
+    if len(shared) == 0:
+        return prefix, [], [], suffix
+
+    x = [w for w in x if w in shared]
+    y = [w for w in y if w in shared]
+    return prefix, x, y, suffix
 
 
 def _lcs(x, y):
@@ -173,7 +345,10 @@ def _recon_lcs(x, y, exclusive=True):
     Returns:
       sequence: LCS of x and y
     """
+    prefix, x, y, suffix = _trim_lcs_inputs(x, y)
     i, j = len(x), len(y)
+    if i == 0 or j == 0:
+        return Ngrams(prefix + suffix, exclusive=exclusive)
     table = _lcs(x, y)
 
     def _recon(i, j):
@@ -188,8 +363,120 @@ def _recon_lcs(x, y, exclusive=True):
             return _recon(i, j - 1)
 
     recon_list = list(map(lambda x: x[0], _recon(i, j)))
-    return Ngrams(recon_list, exclusive=exclusive)
-    return recon_tuple
+    return Ngrams(prefix + recon_list + suffix, exclusive=exclusive)
+
+
+def _batch_lcs_tables(pairs):
+    """
+    Computes the LCS DP tables of many pairs of sequences at once.
+    Sequences are int-encoded and padded, then the tables are filled one
+    anti-diagonal at a time: every cell of a diagonal only depends on the
+    two previous ones, so a diagonal is a single vectorized step over the
+    whole batch. This costs max(n + m) numpy steps instead of sum(n * m)
+    python steps. Padding never matches, and cells beyond a pair's own
+    lengths are never read back.
+
+    Args:
+      pairs: list of (x, y) sequences of words
+
+    Returns:
+      int array of shape (len(pairs), max(n) + 1, max(m) + 1) where
+      `table[b, i, j]` is `_lcs(*pairs[b])[i, j]` for i <= n_b, j <= m_b
+    """
+    if np is None:
+        raise ImportError("The 'numpy' LCS backend requires numpy")
+
+    vocab = {}
+    n_max = max(len(x) for x, _ in pairs)
+    m_max = max(len(y) for _, y in pairs)
+    xs = np.full((len(pairs), n_max), -1, dtype=np.int64)
+    ys = np.full((len(pairs), m_max), -2, dtype=np.int64)
+    for b, (x, y) in enumerate(pairs):
+        xs[b, :len(x)] = [vocab.setdefault(w, len(vocab)) for w in x]
+        ys[b, :len(y)] = [vocab.setdefault(w, len(vocab)) for w in y]
+
+    table = np.zeros((len(pairs), n_max + 1, m_max + 1), dtype=np.int32)
+    for d in range(2, n_max + m_max + 1):
+        i = np.arange(max(1, d - m_max), min(n_max, d - 1) + 1)
+        j = d - i
+        match = xs[:, i - 1] == ys[:, j - 1]
+        table[:, i, j] = np.where(
+            match,
+            table[:, i - 1, j - 1] + 1,
+            np.maximum(table[:, i - 1, j], table[:, i, j - 1]))
+    return table
+
+
+def _batch_recon_lcs(pairs, max_cells=1 << 24):
+    """
+    Batched equivalent of `_recon_lcs` based on `_batch_lcs_tables`.
+
+    Args:
+      pairs: iterable of (x, y) sequences of words
+      max_cells: maximum number of DP table cells of a batch, i.e.
+                 B * (max(n) + 1) * (max(m) + 1), bounds memory usage.
+                 A single pair larger than that is computed alone.
+
+    Returns:
+      dict mapping (tuple(x), tuple(y)) to the list of words of the LCS, as
+      returned by `_recon_lcs`
+    """
+    lcs = {}
+    cores = []
+    for x, y in pairs:
+        key = (tuple(x), tuple(y))
+        if key in lcs:
+            continue
+        prefix, core_x, core_y, suffix = _trim_lcs_inputs(x, y)
+        lcs[key] = prefix + suffix
+        if len(core_x) > 0 and len(core_y) > 0:
+            cores.append((key, core_x, core_y, len(prefix)))
+
+    # similar lengths in a batch means less padding
+    cores.sort(key=lambda c: (len(c[1]), len(c[2])))
+    batches, batch, m_max = [], [], 0
+    for core in cores:
+        # cores are sorted by n, so max(n) is the one of `core`
+        n, m = len(core[1]), len(core[2])
+        cells = (len(batch) + 1) * (n + 1) * (max(m_max, m) + 1)
+        if len(batch) > 0 and cells > max_cells:
+            batches.append(batch)
+            batch, m_max = [], 0
+        batch.append(core)
+        m_max = max(m_max, m)
+    if len(batch) > 0:
+        batches.append(batch)
+
+    for batch in batches:
+        tables = _batch_lcs_tables([(x, y) for _, x, y, _ in batch])
+        for (key, x, y, prefix_len), table in zip(batch, tables):
+            recon_list = []
+            i, j = len(x), len(y)
+            while i > 0 and j > 0:
+                if x[i - 1] == y[j - 1]:
+                    recon_list.append(x[i - 1])
+                    i, j = i - 1, j - 1
+                elif table[i - 1, j] > table[i, j - 1]:
+                    i -= 1
+                else:
+                    j -= 1
+            recon_list.reverse()
+            words = lcs[key]
+            lcs[key] = words[:prefix_len] + recon_list + words[prefix_len:]
+    return lcs
+
+
+def _lcs_sentence_pairs(evaluated_sentences, reference_sentences):
+    """
+    Lists the (reference words, evaluated words) pairs whose LCS is needed
+    by `rouge_l_summary_level`.
+    """
+    pairs = []
+    for ref_s in reference_sentences:
+        reference_words = _split_into_words([ref_s])
+        for eval_s in evaluated_sentences:
+            pairs.append((reference_words, _split_into_words([eval_s])))
+    return pairs
 
 
 def multi_rouge_n(sequences, scores_ids, n=2, exclusive=True):
@@ -230,6 +517,116 @@ def multi_rouge_n(sequences, scores_ids, n=2, exclusive=True):
     return scores
 
 
+def sketch_rouge_n(sentences, n=2, num_perm=128, exclusive=True, seed=1):
+    """
+    Builds the `NgramsSketch` of a collection of sentences, to be stored
+    and later compared with `approx_rouge_n`.
+
+    Args:
+      sentences: list of sentences
+      n: Size of ngram.  Defaults to 2.
+      num_perm: signature size, higher is more accurate and slower
+      seed: seed of the hash functions, must be the same for all sketches
+            compared with each other
+
+    Returns:
+      NgramsSketch
+    """
+    if len(sentences) <= 0:
+        raise ValueError("Collections must contain at least 1 sentence.")
+    ngrams = _get_word_ngrams(n, sentences, exclusive=exclusive)
+    return NgramsSketch(ngrams, n, num_perm=num_perm, seed=seed)
+
+
+def approx_rouge_n(evaluated_sketch, reference_sketch, raw_results=False):
+    """
+    Estimates ROUGE-N from two `NgramsSketch`, see `sketch_rouge_n`.
+    n-gram counts are exact, only the overlap is approximated.
+
+    Returns:
+      A dict with 'f', 'p', 'r' (or 'hyp', 'ref', 'overlap' when
+      `raw_results`)
+    """
+    evaluated_count = len(evaluated_sketch)
+    reference_count = len(reference_sketch)
+    overlapping_count = evaluated_sketch.intersection_count(reference_sketch)
+
+    if raw_results:
+        o = {
+            "hyp": evaluated_count,
+            "ref": reference_count,
+            "overlap": overlapping_count
+        }
+        return o
+    else:
+        return f_r_p_rouge_n(
+            evaluated_count, reference_count, overlapping_count)
+
+
+def rouge_n_top_k(evaluated_sentences, references, n=2, k=10, stat="f",
+                  num_perm=128, reference_sketches=None, exclusive=True,
+                  seed=1):
+    """
+    Finds the `k` references with the highest ROUGE-N against a hypothesis.
+    Every reference is first scored approximately from its sketch, then
+    only the `k` best candidates are re-scored exactly with `rouge_n`.
+
+    Args:
+        evaluated_sentences(list[str]): hypothesis sentences
+        references(list[list[str]]): reference sentences, indexable by id
+        k: number of candidates to re-score exactly
+        stat: one of 'f', 'p', 'r', used to rank references
+        num_perm: signature size, trades accuracy for speed
+        reference_sketches(NgramsSketchIndex): precomputed sketches of
+            `references`, built with the same `n`, `num_perm`, `exclusive`
+            and `seed`. A list of `NgramsSketch` is also accepted, but
+            stacking it costs about as much as the ranking itself: build
+            the index once when querying the same references repeatedly.
+
+    Returns:
+        list of at most `k` pairs (ref_id, scores) sorted by exact `stat`,
+        best first
+    """
+    if reference_sketches is None:
+        reference_sketches = [
+            sketch_rouge_n(ref, n=n, num_perm=num_perm,
+                           exclusive=exclusive, seed=seed)
+            for ref in references]
+    if not isinstance(reference_sketches, NgramsSketchIndex):
+        reference_sketches = NgramsSketchIndex(reference_sketches)
+    if len(reference_sketches) != len(references):
+        raise ValueError("Expected one sketch per reference.")
+
+    evaluated_sketch = sketch_rouge_n(evaluated_sentences, n=n,
+                                      num_perm=num_perm,
+                                      exclusive=exclusive, seed=seed)
+    evaluated_count = len(evaluated_sketch)
+    reference_counts = reference_sketches.counts
+    overlapping_counts = reference_sketches.intersection_counts(
+        evaluated_sketch)
+
+    # vectorized version of `f_r_p_rouge_n`
+    if evaluated_count == 0:
+        precision = np.zeros(len(reference_counts))
+    else:
+        precision = overlapping_counts / evaluated_count
+    recall = np.divide(overlapping_counts, reference_counts,
+                       out=np.zeros(len(reference_counts)),
+                       where=reference_counts > 0)
+    approx_scores = {
+        "p": precision,
+        "r": recall,
+        "f": 2.0 * ((precision * recall) / (precision + recall + 1e-8)),
+    }[stat].tolist()
+    candidates = heapq.nlargest(k, range(len(references)),
+                                key=approx_scores.__getitem__)
+
+    scores = [(ref_id, rouge_n(evaluated_sentences, references[ref_id],
+                               n=n, exclusive=exclusive))
+              for ref_id in candidates]
+    return sorted(scores, key=lambda x: x[1][stat], reverse=True)
+
+
 def rouge_n(evaluated_sentences, reference_sentences,
             n=2, raw_results=False, exclusive=True):
     """
@@ -295,7 +692,7 @@ def f_r_p_rouge_n(evaluated_count, reference_count, overlapping_count):
 
 
 def _union_lcs(evaluated_sentences, reference_sentence,
-               prev_union=None, exclusive=True):
+               prev_union=None, exclusive=True, lcs_cache=None):
     """
     Returns LCS_u(r_i, C) which is the LCS score of the union longest common
     subsequence between reference sentence ri and candidate summary C.
@@ -310,6 +707,7 @@ def _union_lcs(evaluated_sentences, reference_sentence,
       evaluated_sentences: The sentences that have been picked by the
                            summarizer
       reference_sentence: One of the sentences in the reference summaries
+      lcs_cache: optional precomputed LCS, see `_batch_recon_lcs`
 
     Returns:
       float: LCS_u(r_i, C)
@@ -330,7 +728,13 @@ def _union_lcs(evaluated_sentences, reference_sentence,
     combined_lcs_length = 0
     for eval_s in evaluated_sentences:
         evaluated_words = _split_into_words([eval_s])
-        lcs = _recon_lcs(reference_words, evaluated_words, exclusive=exclusive)
+        if lcs_cache is None:
+            lcs = _recon_lcs(reference_words, evaluated_words,
+                             exclusive=exclusive)
+        else:
+            lcs = Ngrams(
+                lcs_cache[tuple(reference_words), tuple(evaluated_words)],
+                exclusive=exclusive)
         combined_lcs_length += len(lcs)
         lcs_union = lcs_union.union(lcs)
 
@@ -339,7 +743,8 @@ def _union_lcs(evaluated_sentences, reference_sentence,
 
 
 def rouge_l_summary_level(
-        evaluated_sentences, reference_sentences, raw_results=False, exclusive=True, **_):
+        evaluated_sentences, reference_sentences, raw_results=False,
+        exclusive=True, lcs_backend="python", lcs_cache=None):
     """
     Computes ROUGE-L (summary level) of two text collections of sentences.
     http://research.microsoft.com/en-us/um/people/cyl/download/papers/rouge-working-note-v1.3.1.pdf
@@ -360,6 +765,10 @@ def rouge_l_summary_level(
       evaluated_sentences: The sentences that have been picked by the
                            summarizer
       reference_sentence: One of the sentences in the reference summaries
+      lcs_backend: one of `LCS_BACKENDS`, 'numpy' computes all sentence
+                   pairs at once with `_batch_recon_lcs`
+      lcs_cache: optional precomputed LCS of every sentence pair, as
+                 returned by `_batch_recon_lcs`
 
     Returns:
       A float: F_lcs
@@ -369,6 +778,14 @@ def rouge_l_summary_level(
     """
     if len(evaluated_sentences) <= 0 or len(reference_sentences) <= 0:
         raise ValueError("Collections must contain at least 1 sentence.")
+    if lcs_backend not in LCS_BACKENDS:
+        raise ValueError("Unknown LCS backend '%s'" % lcs_backend)
+    if lcs_backend == "numpy" and np is None:
+        raise ImportError("The 'numpy' LCS backend requires numpy")
+
+    if lcs_cache is None and lcs_backend == "numpy":
+        lcs_cache = _batch_recon_lcs(
+            _lcs_sentence_pairs(evaluated_sentences, reference_sentences))
 
     # total number of words in reference sentences
     m = len(
@@ -389,7 +806,8 @@ def rouge_l_summary_level(
         lcs_count, union = _union_lcs(evaluated_sentences,
                                       ref_s,
                                       prev_union=union,
-                                      exclusive=exclusive)
+                                      exclusive=exclusive,
+                                      lcs_cache=lcs_cache)
         union_lcs_sum_across_all_references += lcs_count
 
     llcs = union_lcs_sum_across_all_references
@@ -43,6 +43,7 @@ setup(
     test_suite="nose.collector",
     tests_require=['nose'],
     install_requires=['six'],
+    extras_require={'numpy': ['numpy']},
     entry_points={
         'console_scripts': [
             'rouge=bin.rouge_cmd:main'
@@ -1,7 +1,12 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import rouge
 import json
+import os
+import pickle
+import shutil
+import tempfile
+from rouge import rouge_score
 
 
 class BasicTest(TestCase):
@@ -36,3 +41,176 @@ class BasicTest(TestCase):
         expected_scores = [d['scores'] for d in data]
         scores = self.files_rouge.get_scores(self.hyp_path, self.ref_path)
         self.assertEqual(expected_scores, scores)
+
+    def test_trimmed_lcs(self):
+        def plain_recon_lcs(x, y):
+            # `_recon_lcs` on the full DP table, without any trimming
+            table = rouge_score._lcs(x, y)
+            i, j, recon_list = len(x), len(y), []
+            while i > 0 and j > 0:
+                if x[i - 1] == y[j - 1]:
+                    recon_list.append(x[i - 1])
+                    i, j = i - 1, j - 1
+                elif table[i - 1, j] > table[i, j - 1]:
+                    i -= 1
+                else:
+                    j -= 1
+            return recon_list[::-1]
+
+        pairs = [
+            # no shared tokens
+            ("a b c", "d e f"),
+            # identical sequences
+            ("a b c a", "a b c a"),
+            # shared prefix only
+            ("a b c d", "a b e f"),
+            # shared suffix only
+            ("c d a b", "e f a b"),
+            # repeated tokens
+            ("a b a c a b", "b a a c b b a"),
+            ("a a x a b", "a b a a y a"),
+        ] + [(d['ref'], d['hyp']) for d in self.data]
+        for x, y in pairs:
+            x, y = x.split(), y.split()
+            table = rouge_score._lcs(x, y)
+            self.assertEqual(rouge_score._len_lcs(x, y),
+                             table[len(x), len(y)])
+            self.assertEqual(
+                rouge_score._recon_lcs(x, y, exclusive=False)._ngrams,
+                plain_recon_lcs(x, y))
+            self.assertEqual(
+                rouge_score._recon_lcs(x, y, exclusive=True)._ngrams,
+                set(plain_recon_lcs(x, y)))
+
+    def test_approx_rouge_n(self):
+        if rouge_score.np is None:
+            self.skipTest("numpy is not installed")
+
+        hyps, refs = zip(*[[d['hyp'].split(" . "), d['ref'].split(" . ")]
+                           for d in self.data])
+        for n in [1, 2]:
+            ref_sketches = [rouge_score.sketch_rouge_n(ref, n, num_perm=256)
+                            for ref in refs]
+            index = rouge_score.NgramsSketchIndex(ref_sketches)
+            for hyp in hyps:
+                hyp_sketch = rouge_score.sketch_rouge_n(hyp, n, num_perm=256)
+                overlaps = index.intersection_counts(hyp_sketch)
+                for ref, ref_sketch, overlap in zip(refs, ref_sketches,
+                                                    overlaps):
+                    exact = rouge_score.rouge_n(hyp, ref, n)
+                    approx = rouge_score.approx_rouge_n(hyp_sketch, ref_sketch)
+                    for s in ["f", "p", "r"]:
+                        self.assertAlmostEqual(exact[s], approx[s], delta=0.1)
+                        self.assertIs(type(approx[s]), float)
+                    self.assertAlmostEqual(
+                        overlap, hyp_sketch.intersection_count(ref_sketch))
+
+            top = rouge_score.rouge_n_top_k(hyps[0], refs, n=n, k=2,
+                                            num_perm=256,
+                                            reference_sketches=index)
+            self.assertEqual(len(top), 2)
+            self.assertEqual(top[0][1], rouge_score.rouge_n(
+                hyps[0], refs[top[0][0]], n))
+
+    def test_incompatible_sketches(self):
+        if rouge_score.np is None:
+            self.skipTest("numpy is not installed")
+
+        sentences = ["a b c d"]
+        sketch = rouge_score.sketch_rouge_n(sentences, n=1)
+        for other in [rouge_score.sketch_rouge_n(sentences, n=2),
+                      rouge_score.sketch_rouge_n(sentences, n=1,
+                                                 exclusive=False),
+                      rouge_score.sketch_rouge_n(sentences, n=1,
+                                                 num_perm=64),
+                      rouge_score.sketch_rouge_n(sentences, n=1, seed=2)]:
+            with self.assertRaises(ValueError):
+                rouge_score.approx_rouge_n(sketch, other)
+            with self.assertRaises(ValueError):
+                rouge_score.NgramsSketchIndex([sketch, other])
+            with self.assertRaises(ValueError):
+                rouge_score.NgramsSketchIndex([other]).intersection_counts(
+                    sketch)
+
+    def test_sketch_size(self):
+        if rouge_score.np is None:
+            self.skipTest("numpy is not installed")
+
+        # the sketch is smaller than the n-grams once there are more
+        # n-grams than `num_perm`
+        sentences = [s for d in self.data for s in d['ref'].split(" . ")]
+        ngrams = rouge_score._get_word_ngrams(2, sentences)
+        sketch = rouge_score.sketch_rouge_n(sentences, 2, num_perm=128)
+        self.assertGreater(len(ngrams), 128)
+        self.assertEqual(sketch.signature.nbytes, 4 * 128)
+        self.assertLess(len(pickle.dumps(sketch)), len(pickle.dumps(ngrams)))
+
+    def test_numpy_lcs_backend(self):
+        if rouge_score.np is None:
+            self.skipTest("numpy is not installed")
+
+        hyps, refs = map(list, zip(*[[d['hyp'], d['ref']] for d in self.data]))
+        numpy_rouge = rouge.Rouge(lcs_backend="numpy")
+        self.assertEqual(self.rouge.get_scores(hyps, refs),
+                         numpy_rouge.get_scores(hyps, refs))
+        self.assertEqual(self.rouge.get_scores(hyps, refs, avg=True),
+                         numpy_rouge.get_scores(hyps, refs, avg=True))
+
+        # tiny batches give the same LCS as one large batch
+        pairs = [(d['ref'].split(), d['hyp'].split()) for d in self.data]
+        self.assertEqual(rouge_score._batch_recon_lcs(pairs),
+                         rouge_score._batch_recon_lcs(pairs, max_cells=1))
+
+    def test_files_scores_checkpoint(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        for avg in [False, True]:
+            expected_scores = self.files_rouge.get_scores(
+                self.hyp_path, self.ref_path, avg=avg)
+            state_path = os.path.join(tmp_dir, "state_%s.json" % avg)
+
+            # interrupt the job after the first checkpoint
+            files_rouge = rouge.FilesRouge()
+            save_state = files_rouge._save_state
+
+            def save_state_and_fail(*args):
+                save_state(*args)
+                raise KeyboardInterrupt()
+
+            with mock.patch.object(files_rouge, "_save_state",
+                                   side_effect=save_state_and_fail):
+                with self.assertRaises(KeyboardInterrupt):
+                    files_rouge.get_scores(
+                        self.hyp_path, self.ref_path, avg=avg,
+                        state_path=state_path, checkpoint_every=1)
+
+            scores = rouge.FilesRouge().get_scores(
+                self.hyp_path, self.ref_path, avg=avg,
+                state_path=state_path, checkpoint_every=1)
+            self.assertEqual(expected_scores, scores)
+
+            with self.assertRaises(ValueError):
+                rouge.FilesRouge(metrics=["rouge-1"]).get_scores(
+                    self.hyp_path, self.ref_path, avg=avg,
+                    state_path=state_path)
+
+            # the state file belongs to (hyp_path, ref_path)
+            with self.assertRaises(ValueError):
+                rouge.FilesRouge().get_scores(
+                    self.ref_path, self.hyp_path, avg=avg,
+                    state_path=state_path)
+
+    def test_files_scores_checkpoint_empty(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        hyp_path = os.path.join(tmp_dir, "hyp.txt")
+        ref_path = os.path.join(tmp_dir, "ref.txt")
+        for path in [hyp_path, ref_path]:
+            open(path, "w").close()
+
+        # same error with and without checkpointing
+        for state_path in [None, os.path.join(tmp_dir, "state.json")]:
+            with self.assertRaises(ZeroDivisionError):
+                self.files_rouge.get_scores(hyp_path, ref_path, avg=True,
+                                            state_path=state_path)